@@ -6,23 +6,32 @@ CLI 编排：
 1) 抓第一页：拿 rank_week / caption / header_keys / 第一页 rows
 2) 决定 CSV 输出路径：output-csv/<rank_week>/dbv_rankings_<rank_week>_<caption>[_first_N].csv
 3) 打开 CSV & SQLite sink
-4) 逐页抓取并同步写入（--max-rank 优先；--stream 流式）
+4) 逐页抓取并写入（--max-rank 优先；--stream 流式）：
+   并发抓取、线程池解析、专职写线程三段重叠，用有界队列背压衔接
 """
 
+import asyncio
 import os
 import re
-import time
+import queue
 import argparse
+import threading
+from functools import partial
 from typing import List, Dict, Optional
 
 from scraper import (
     create_session, fetch_html_with_cookiewall, parse_ruler_table,
-    parse_rank_week, extract_caption, set_query_param, slugify_for_filename,
-    REQUEST_SLEEP, FIXED_RAW_FIELDS
+    parse_ruler_table_streaming, parse_rank_week, extract_caption,
+    set_query_param, slugify_for_filename, async_fetch_pages,
+    FIXED_RAW_FIELDS, STREAM_PARSE_MIN_PAGE_SIZE
 )
 from sinks.csv_sink import CSVWriterSink
 from sinks.sqlite_sink import SQLiteSink
 
+# 抓取/解析 → 写入 之间的有界队列深度：写线程落后时对抓取端形成背压
+_WRITE_QUEUE_MAX = 4
+
+
 # -------- CSV 字段顺序计算：常规列 -> (*_raw 可选) -> RankWeek 最后 --------
 def compute_fieldnames(header_keys: List[str], keep_raw: bool) -> List[str]:
     base_headers = [k for k in header_keys if k != "RankWeek"]
@@ -50,6 +59,7 @@ def main():
     ap.add_argument("--keep-flag", action="store_true", help="保留空白 UI 列 'Flag'（默认不保留）")
     ap.add_argument("--no-proxy", action="store_true", help="禁用系统代理环境变量（排查代理导致的 TLS 问题）")
     ap.add_argument("--stream", action="store_true", help="启用流式写入：解析一页立刻写入 CSV/SQLite")
+    ap.add_argument("--safe-csv", action="store_true", help="CSV 走标准 csv.writer（默认为更快的字节直写路径）")
     # raw 审计开关：默认不输出 *_raw；需要时 --with-raw
     g = ap.add_mutually_exclusive_group()
     g.add_argument("--no-raw", dest="keep_raw", action="store_false", help="不输出任何 *_raw 列（默认）")
@@ -59,6 +69,8 @@ def main():
     # SQLite 相关
     ap.add_argument("--to-sqlite", action="store_true", help="同时写入 SQLite（默认关闭）")
     ap.add_argument("--db-path", default="db/rankings.sqlite", help="SQLite 路径（默认 db/rankings.sqlite）")
+    ap.add_argument("--pack", action="store_true",
+                    help="SQLite 按页打包写入 rankings_pages（msgpack+zstd，一页一行；需 --to-sqlite）")
 
     args = ap.parse_args()
 
@@ -66,19 +78,24 @@ def main():
         print("[提示] 同时给了 --max-pages 与 --max-rank；将以 --max-rank 为准，忽略 --max-pages。")
     use_max_pages = (args.max_pages is not None) and (args.max_rank is None)
 
+    # 超大页用 iterparse 流式解析，峰值内存与页大小无关
+    parse_fn = parse_ruler_table_streaming if args.page_size >= STREAM_PARSE_MIN_PAGE_SIZE else parse_ruler_table
+
     # 起始页
     page = args.start_page
     with create_session(no_proxy=args.no_proxy) as sess:
-        url_first = set_query_param(set_query_param(args.url, p=page), ps=args.page_size)
+        url_first = set_query_param(args.url, p=page, ps=args.page_size)
         print(f"[抓取] 第 {page} 页: {url_first}")
         html = fetch_html_with_cookiewall(url_first, sess=sess)
 
-        # 基础信息
+        # 基础信息（rank_week 走预编译 XPath；caption 是唯一剩下的 bs4 消费者）
         rank_week = parse_rank_week(html) or "UnknownWeek"
         caption_text = extract_caption(html) or "UnknownCategory"
 
-        # 解析第一页
-        rows, header_keys = parse_ruler_table(html, keep_flag=args.keep_flag, rank_week=rank_week, keep_raw=args.keep_raw)
+        # 解析第一页（表格热路径走 lxml.etree，直接吃原始 HTML）
+        rows, header_keys = parse_fn(html, keep_flag=args.keep_flag, rank_week=rank_week, keep_raw=args.keep_raw)
+        # rows 已是纯 dict；立刻释放首页原始 HTML，峰值内存只与单页相关
+        html = None
         # 字段顺序
         fieldnames = compute_fieldnames(header_keys, keep_raw=args.keep_raw)
 
@@ -96,7 +113,7 @@ def main():
         print(f"[命名] RankWeek='{rank_week}', caption='{caption_text}' → CSV：{out_csv}")
 
         # 打开 sinks
-        csv_sink = CSVWriterSink(out_csv, fieldnames)
+        csv_sink = CSVWriterSink(out_csv, fieldnames, safe=args.safe_csv)
         sqlite_sink = SQLiteSink(args.db_path) if args.to_sqlite else None
 
         with csv_sink as csv_out, (sqlite_sink if sqlite_sink else open(os.devnull, "w")) as maybe_sql:
@@ -104,98 +121,136 @@ def main():
                 print(f"[SQLite] 写入数据库：{args.db_path}")
                 sqlite_sink.ensure_schema()
 
-            def sink_write(page_rows: List[Dict]):
+            def _sink_write(page_rows: List[Dict], page_no: int):
                 if not page_rows:
                     return
                 csv_out.write_many(page_rows)
                 if sqlite_sink:
-                    sqlite_sink.write_many(page_rows, caption=caption_text, rank_week=rank_week)
-
-            # 写第一页
-            if args.max_rank is not None:
-                to_write = [r for r in rows if isinstance(r.get("Rank"), int) and r["Rank"] <= args.max_rank]
-            else:
-                to_write = rows
-            print(f"  ↳ 第 {page} 页解析 {len(rows)} 条，写入 {len(to_write)} 条")
-            sink_write(to_write)
-
-            pages_done = 1
-            written = len(to_write)
-            last_count = len(rows)
-
-            # 终止条件（第一页后）
-            if args.max_rank is not None and written >= args.max_rank:
-                print(f"[完成] 已写前 {written} 条（达到 --max-rank） → {out_csv}")
-                return
-            if last_count < args.page_size:
-                if args.max_rank is not None and written < args.max_rank:
-                    print(f"[提示] 实际仅有 {written} 条；少于 --max-rank={args.max_rank}。")
-                print(f"[完成] 共 {pages_done} 页，已写入 {out_csv}")
-                return
-            if use_max_pages and pages_done >= args.max_pages:
-                print(f"[停止] 已达到 --max-pages={args.max_pages} 上限。")
-                print(f"[完成] 已写入 {out_csv}")
-                return
-
-            # 后续页循环
-            while True:
-                page += 1
-                url = set_query_param(set_query_param(args.url, p=page), ps=args.page_size)
-                print(f"[抓取] 第 {page} 页: {url}")
-                html = fetch_html_with_cookiewall(url, sess=sess)
-                rows, _ = parse_ruler_table(html, keep_flag=args.keep_flag, rank_week=rank_week, keep_raw=args.keep_raw)
-
-                if args.stream:
-                    if args.max_rank is not None:
-                        # 只写 rank <= max_rank；一旦页内都超过范围则停止
-                        to_write = []
-                        for r in rows:
-                            rk = r.get("Rank")
-                            if isinstance(rk, int) and rk <= args.max_rank:
-                                to_write.append(r)
-                            else:
-                                break
-                        print(f"  ↳ 解析 {len(rows)} 条，写入 {len(to_write)} 条（流式）")
-                        sink_write(to_write)
-                        written += len(to_write)
-                        if written >= args.max_rank:
-                            print(f"[完成] 已写前 {written} 条（达到 --max-rank） → {out_csv}")
-                            break
-                        if len(to_write) == 0:
-                            print("[停止] 本页 Rank 全部超过 --max-rank，停止抓取后续页。")
-                            break
+                    if args.pack:
+                        sqlite_sink.write_page_blob(page_rows, caption=caption_text,
+                                                    rank_week=rank_week, page=page_no)
                     else:
-                        print(f"  ↳ 解析 {len(rows)} 条（流式写入）")
-                        sink_write(rows)
+                        sqlite_sink.write_many(page_rows, caption=caption_text, rank_week=rank_week)
+
+            # 专职写线程：CSV/SQLite 落盘与抓取、解析重叠；有界队列做背压，None 哨兵收尾
+            write_q: "queue.Queue" = queue.Queue(maxsize=_WRITE_QUEUE_MAX)
+            write_exc: List[BaseException] = []
+
+            def _writer():
+                while True:
+                    item = write_q.get()
+                    if item is None:
+                        break
+                    if write_exc:
+                        continue  # 已出错：只清空队列不再写，生产端的 put/哨兵不会被堵死
+                    try:
+                        _sink_write(*item)
+                    except BaseException as e:
+                        write_exc.append(e)
+
+            writer_t = threading.Thread(target=_writer, name="sink-writer", daemon=True)
+            writer_t.start()
+
+            def sink_write(page_rows: List[Dict], page_no: int):
+                # 先于入队检查写线程是否已报错，避免对死队列无限阻塞
+                if write_exc:
+                    raise write_exc[0]
+                write_q.put((page_rows, page_no))
+
+            try:
+                # 写第一页
+                if args.max_rank is not None:
+                    to_write = [r for r in rows if isinstance(r.get("Rank"), int) and r["Rank"] <= args.max_rank]
                 else:
-                    # 非流式：同样直接写（为了避免内存占用）；如果你坚持聚合，可改为 all_rows.extend(rows)
-                    if args.max_rank is not None:
-                        to_write = []
-                        for r in rows:
-                            rk = r.get("Rank")
-                            if isinstance(rk, int) and rk <= args.max_rank:
-                                to_write.append(r)
-                            else:
-                                break
-                        print(f"  ↳ 解析 {len(rows)} 条，写入 {len(to_write)} 条")
-                        sink_write(to_write)
-                        written += len(to_write)
-                        if written >= args.max_rank:
-                            print(f"[完成] 已写前 {written} 条（达到 --max-rank） → {out_csv}")
-                            break
-                    else:
-                        print(f"  ↳ 解析 {len(rows)} 条")
-                        sink_write(rows)
+                    to_write = rows
+                print(f"  ↳ 第 {page} 页解析 {len(rows)} 条，写入 {len(to_write)} 条")
+                sink_write(to_write, page)
+
+                pages_done = 1
+                written = len(to_write)
+                last_count = len(rows)
 
-                pages_done += 1
-                if len(rows) < args.page_size:
-                    print("  ↳ 本页少于 page_size，推断为最后一页，停止。")
-                    break
+                # 终止条件（第一页后）
+                if args.max_rank is not None and written >= args.max_rank:
+                    print(f"[完成] 已写前 {written} 条（达到 --max-rank） → {out_csv}")
+                    return
+                if last_count < args.page_size:
+                    if args.max_rank is not None and written < args.max_rank:
+                        print(f"[提示] 实际仅有 {written} 条；少于 --max-rank={args.max_rank}。")
+                    print(f"[完成] 共 {pages_done} 页，已写入 {out_csv}")
+                    return
                 if use_max_pages and pages_done >= args.max_pages:
                     print(f"[停止] 已达到 --max-pages={args.max_pages} 上限。")
-                    break
+                    print(f"[完成] 已写入 {out_csv}")
+                    return
+
+                # 后续页：并发预取（信号量限流），解析放线程池避免阻塞事件循环
+                suffix = "（流式）" if args.stream else ""
+
+                async def crawl_rest():
+                    nonlocal page, pages_done, written
+                    loop = asyncio.get_running_loop()
+
+                    # 能推算出的页数上限，避免批量预取越界页
+                    end_page = None
+                    if args.max_rank is not None:
+                        end_page = args.start_page + (-(-args.max_rank // args.page_size)) - 1
+                    elif use_max_pages:
+                        end_page = args.start_page + args.max_pages - 1
+
+                    agen = async_fetch_pages(
+                        args.url, page + 1, args.page_size,
+                        end_page=end_page, cookies=sess.cookies.get_dict(),
+                    )
+                    async for p, html in agen:
+                        page = p
+                        print(f"[抓取] 第 {p} 页 (ps={args.page_size})")
+                        rows, _ = await loop.run_in_executor(
+                            None,
+                            partial(parse_fn, html, keep_flag=args.keep_flag,
+                                    rank_week=rank_week, keep_raw=args.keep_raw),
+                        )
+                        html = None  # 原始 HTML 用完即弃，避免跨迭代驻留
+
+                        if args.max_rank is not None:
+                            # 只写 rank <= max_rank；一旦页内都超过范围则停止
+                            to_write = []
+                            for r in rows:
+                                rk = r.get("Rank")
+                                if isinstance(rk, int) and rk <= args.max_rank:
+                                    to_write.append(r)
+                                else:
+                                    break
+                            print(f"  ↳ 解析 {len(rows)} 条，写入 {len(to_write)} 条{suffix}")
+                            sink_write(to_write, p)
+                            written += len(to_write)
+                            pages_done += 1
+                            if written >= args.max_rank:
+                                print(f"[完成] 已写前 {written} 条（达到 --max-rank） → {out_csv}")
+                                break
+                            if len(to_write) == 0:
+                                print("[停止] 本页 Rank 全部超过 --max-rank，停止抓取后续页。")
+                                break
+                        else:
+                            print(f"  ↳ 解析 {len(rows)} 条{suffix}")
+                            sink_write(rows, p)
+                            pages_done += 1
+
+                        if len(rows) < args.page_size:
+                            print("  ↳ 本页少于 page_size，推断为最后一页，停止。")
+                            break
+                        if use_max_pages and pages_done >= args.max_pages:
+                            print(f"[停止] 已达到 --max-pages={args.max_pages} 上限。")
+                            break
+                    await agen.aclose()
 
-                time.sleep(REQUEST_SLEEP)
+                asyncio.run(crawl_rest())
+            finally:
+                # 收尾：哨兵 + join，保证尾批在 sinks 关闭前全部落盘
+                write_q.put(None)
+                writer_t.join()
+                if write_exc:
+                    raise write_exc[0]
 
         print(f"[完成] 共 {pages_done} 页，已写入 {out_csv}")
         if args.max_rank is not None and written < args.max_rank:
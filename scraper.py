@@ -12,16 +12,26 @@ scraper.py
 - 默认不输出 *_raw 列；支持 keep_raw=True 输出
 """
 
+import asyncio
+import io
 import re
 import time
 import unicodedata
-from typing import Dict, List, Optional, Tuple
+from collections import deque
+from typing import AsyncIterator, Dict, List, NamedTuple, Optional, Tuple, Union
 from urllib.parse import urlparse, parse_qs, urlencode, urlunparse, urljoin, parse_qsl
 
+import httpx
 import requests
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
-from bs4 import BeautifulSoup, Tag
+from bs4 import BeautifulSoup
+from lxml import etree
+
+try:
+    import pandas as pd
+except ImportError:  # pandas 可选：缺失时数值清洗退回逐行路径
+    pd = None
 
 # 网络 & 重试
 HEADERS = {
@@ -29,16 +39,65 @@ HEADERS = {
     "Accept": "text/html,application/xhtml+xml",
 }
 REQUEST_TIMEOUT = 30
-REQUEST_SLEEP = 0.9  # 翻页间隔
 MAX_SSL_RETRIES = 3
+ASYNC_CONCURRENCY = 8   # 异步翻页并发上限（信号量 & 单主机连接数）
+ASYNC_CHUNK_PAGES = 32  # 每批 gather 的页数
+RATE_PER_S = 2.0        # 翻页限速：每秒放行的请求数（被 429 时自适应放缓）
+MAX_RATE_INTERVAL = 30.0  # 退避时的间隔上限（秒）
+MAX_429_RETRIES = 5
 
 # 固定 raw 字段清单（用于 CSV 字段顺序）
 FIXED_RAW_FIELDS = ["RankChange_raw", "Rank_raw", "BirthYear_raw", "Points_raw", "Tournaments_raw"]
 
+# 表格热路径用 lxml XPath，模块加载时编译一次
+_XPATH_TABLE = etree.XPath(
+    "//table[contains(concat(' ', normalize-space(@class), ' '), ' ruler ')]"
+)
+_XPATH_HEADER_THS = etree.XPath("(.//tr)[1]/th")
+_XPATH_ROWS = etree.XPath(
+    ".//tr[not(th) and not(td[contains(concat(' ', normalize-space(@class), ' '), ' noruler ')])]"
+)
+_PLAYER_HREF_RE = re.compile(r"[?&]player=(\d+)")
+# RL-Woche 的三个候选位置并成一条 XPath，取第一个命中的文本节点
+_XPATH_RANK_WEEK = etree.XPath(
+    "(//*[contains(@class,'rankingdate')]/text()"
+    " | //select[contains(@class,'publication')]/option[@selected]/text()"
+    " | //*[@id='cphPage_cphPage_cphPage_dlPublication_chosen']"
+    "//a[contains(@class,'chosen-single')]/span/text())[1]"
+)
+
+# 行级热循环里用到的正则统一预编译，避免每行查 re 内部缓存
+_WS_RE = re.compile(r"\s+")
+_PREV_RANK_RE = re.compile(r"Previous rank:\s*(\d+)")
+_WW_YYYY_RE = re.compile(r"(\d{1,2})-(\d{4})$")
+_DIGITS_RE = re.compile(r"\d+")
+_COOKIEWALL_ACTION_RE = re.compile(r"/cookiewall/Save$", re.I)
+
+# 数值清洗：str.translate 删光 ASCII 里除 0-9 和 '-' 外的字符（比正则快数倍、
+# 不产生 Match 对象）；罕见的非 ASCII 残余（&nbsp;、全角数字等）退回正则处理
+_NUM_RE = re.compile(r"[^\d\-]")
+_NUM_TRANS = str.maketrans("", "", "".join(
+    chr(i) for i in range(128) if chr(i) not in set("0123456789-")
+))
+
+# 行数达到该阈值且装了 pandas 时，数值清洗走向量化批处理
+_BATCH_COERCE_MIN_ROWS = 50
+_NUMERIC_FIELDS = ("Rank", "BirthYear", "Points", "Tournaments", "RankChange")
+
+# 表头的规范顺序模板：一次性排出最终列序（虚拟列强制在列），
+# 代替逐个 index()+insert() 的 O(n) 操作；未知列保持原顺序插在 RankWeek 之前
+# （RankWeek 永远是 header_keys 的最后一项，下游以此为不变量）
+_CANON_ORDER = ("Rank", "RankChange", "PreviousRank", "Player", "PlayerId",
+                "BirthYear", "Points", "Region", "Club", "Tournaments", "RankWeek")
+_VIRTUAL_COLS = frozenset(("PreviousRank", "PlayerId", "RankWeek"))
+
+# --page-size 达到该值时 main 改用 parse_ruler_table_streaming（iterparse，内存恒定）
+STREAM_PARSE_MIN_PAGE_SIZE = 500
+
 
 # =============== 工具函数 ===============
 def normalize_ws(s: str) -> str:
-    return re.sub(r"\s+", " ", s or "").strip()
+    return _WS_RE.sub(" ", s or "").strip()
 
 
 def set_query_param(url: str, **params) -> str:
@@ -64,7 +123,7 @@ def slugify_for_filename(text: str) -> str:
 
 
 def create_session(no_proxy: bool = False) -> requests.Session:
-    """稳定 Session：重试/退避、可禁用系统代理、关闭连接复用"""
+    """稳定 Session：重试/退避、可禁用系统代理、Keep-Alive 连接复用"""
     s = requests.Session()
     if no_proxy:
         s.trust_env = False
@@ -80,20 +139,23 @@ def create_session(no_proxy: bool = False) -> requests.Session:
     adapter = HTTPAdapter(max_retries=retry, pool_connections=16, pool_maxsize=32)
     s.mount("https://", adapter)
     s.mount("http://", adapter)
-    s.headers.update({**HEADERS, "Connection": "close"})
+    # 不再发送 "Connection: close"：同一主机连续翻页时由 urllib3 连接池复用
+    # TCP+TLS 连接，省掉每页一次完整握手
+    s.headers.update(HEADERS)
+    s._cookie_wall_cleared = False  # 通过一次 CookieWall 后不再逐页解析检查
     return s
 
 
 # =============== CookieWall ===============
 def _is_cookie_wall(html: str) -> bool:
-    soup = BeautifulSoup(html, "html.parser")
-    form = soup.find("form", attrs={"action": re.compile(r"/cookiewall/Save$", re.I)})
+    soup = BeautifulSoup(html, "lxml")
+    form = soup.find("form", attrs={"action": _COOKIEWALL_ACTION_RE})
     return form is not None
 
 
 def _extract_return_url_from_cookiewall(html: str) -> str:
-    soup = BeautifulSoup(html, "html.parser")
-    form = soup.find("form", attrs={"action": re.compile(r"/cookiewall/Save$", re.I)})
+    soup = BeautifulSoup(html, "lxml")
+    form = soup.find("form", attrs={"action": _COOKIEWALL_ACTION_RE})
     if not form:
         raise RuntimeError("CookieWall 表单未找到")
     ret = form.find("input", {"name": "ReturnUrl"})
@@ -132,12 +194,16 @@ def fetch_html_with_cookiewall(url: str, sess: Optional[requests.Session] = None
                 r = s.get(url, headers=s.headers, timeout=REQUEST_TIMEOUT, allow_redirects=True)
                 r.raise_for_status()
                 html = r.text
-                if _is_cookie_wall(html):
-                    base = f"{urlparse(url).scheme}://{urlparse(url).netloc}"
-                    try:
-                        html = _accept_cookies(s, base, html, accept_all=True)
-                    except RuntimeError:
-                        return html
+                # 会话 cookie 生效后 CookieWall 不可能再出现，跳过逐页解析；
+                # 检查时先做廉价的子串探测，命中才解析整页
+                if not getattr(s, "_cookie_wall_cleared", False):
+                    if "cookiewall/Save" in html and _is_cookie_wall(html):
+                        base = f"{urlparse(url).scheme}://{urlparse(url).netloc}"
+                        try:
+                            html = _accept_cookies(s, base, html, accept_all=True)
+                        except RuntimeError:
+                            return html
+                    s._cookie_wall_cleared = True
                 return html
             except requests.exceptions.SSLError:
                 ssl_attempt += 1
@@ -153,43 +219,154 @@ def fetch_html_with_cookiewall(url: str, sess: Optional[requests.Session] = None
             s.close()
 
 
-# =============== RankWeek / Caption ===============
-def parse_rank_week(html: str) -> Optional[str]:
+class RateLimiter:
     """
-    RL-Woche: <span class="rankingdate">(WW-YYYY)</span> 或 <select class="publication"><option selected>WW-YYYY</option>
-    返回 YYYY-WW
+    异步令牌桶限速：按 rate_per_s 匀速放行，acquire 只补足距上次放行的差额，
+    服务器快时不再像固定 sleep 那样白等。收到 429/Retry-After 将间隔加倍
+    （不超过 MAX_RATE_INTERVAL），连续 10 次干净响应后减半恢复到基准速率。
     """
-    soup = BeautifulSoup(html, "html.parser")
 
-    nd = soup.select_one(".rankingdate")
-    if nd:
-        raw = nd.get_text(strip=True).strip("()")
-        m = re.match(r"(\d{1,2})-(\d{4})$", raw)
-        if m:
-            ww, yyyy = m.group(1).zfill(2), m.group(2)
-            return f"{yyyy}-{ww}"
+    def __init__(self, rate_per_s: float = RATE_PER_S):
+        self.base_interval = 1.0 / rate_per_s
+        self.interval = self.base_interval
+        self._next_at = 0.0
+        self._clean = 0
+
+    async def acquire(self):
+        # 事件循环单线程：读改 _next_at 之间无 await，天然原子
+        now = time.monotonic()
+        slot = max(self._next_at, now)
+        self._next_at = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def throttle(self, retry_after: Optional[float] = None):
+        """服务器推回（429 / Retry-After）：间隔加倍"""
+        self.interval = min(max(self.interval * 2, retry_after or 0.0), MAX_RATE_INTERVAL)
+        self._clean = 0
+
+    def relax(self):
+        """干净响应：连续 10 次后把间隔减半收回基准"""
+        if self.interval > self.base_interval:
+            self._clean += 1
+            if self._clean >= 10:
+                self.interval = max(self.base_interval, self.interval / 2)
+                self._clean = 0
+
+
+def _parse_retry_after(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value) if value else None
+    except ValueError:  # HTTP-date 形式的 Retry-After 不解析，按普通退避处理
+        return None
 
-    opt = soup.select_one("select.publication option[selected]")
-    if opt:
-        raw = opt.get_text(strip=True)
-        m = re.match(r"(\d{1,2})-(\d{4})$", raw)
-        if m:
-            ww, yyyy = m.group(1).zfill(2), m.group(2)
-            return f"{yyyy}-{ww}"
 
-    chosen_span = soup.select_one("#cphPage_cphPage_cphPage_dlPublication_chosen a.chosen-single span")
-    if chosen_span:
-        raw = chosen_span.get_text(strip=True)
-        m = re.match(r"(\d{1,2})-(\d{4})$", raw)
-        if m:
-            ww, yyyy = m.group(1).zfill(2), m.group(2)
-            return f"{yyyy}-{ww}"
+async def async_fetch_pages(
+    url: str,
+    start_page: int,
+    page_size: int,
+    concurrency: int = ASYNC_CONCURRENCY,
+    chunk_pages: int = ASYNC_CHUNK_PAGES,
+    end_page: Optional[int] = None,
+    cookies: Optional[Dict[str, str]] = None,
+    rate_per_s: float = RATE_PER_S,
+) -> AsyncIterator[Tuple[int, str]]:
+    """
+    异步并发翻页抓取：按页码顺序产出 (page, html)。
+    - httpx.AsyncClient(http2=True)：批内请求在一条 TLS 会话上多路复用，
+      免去每连接的 TCP/TLS 握手（服务器不支持 h2 时自动回落 HTTP/1.1 keep-alive）
+    - 每批最多 chunk_pages 页，批内各页独立建 task 并发、Semaphore(concurrency) 限流；
+      按页码顺序逐页 await/yield，无整批屏障：首页一到手即产出，
+      提前 break/aclose 时未完成的 task 会被取消（不会把整批多余页抓完）
+    - cookies 传入首页会话的 CookieWall cookie
+    - end_page（由 --max-pages / --max-rank 推算的上限）已知时不会多抓
+    调用方在识别到最后一页（行数 < page_size 或达到 --max-rank）后 break 即可。
+    """
+    sem = asyncio.Semaphore(concurrency)
+    limiter = RateLimiter(rate_per_s)
+    limits = httpx.Limits(max_keepalive_connections=concurrency, max_connections=concurrency)
+    transport = httpx.AsyncHTTPTransport(http2=True, limits=limits, retries=3)
+
+    # URL 只解析一次；循环内仅 p 变化，免去每页 4 次 urlparse/parse_qs 往返
+    parts = urlparse(url)
+    base = f"{parts.scheme}://{parts.netloc}{parts.path}"
+    query = dict(parse_qsl(parts.query))
+    query["ps"] = str(page_size)
+
+    async with httpx.AsyncClient(
+        transport=transport, timeout=REQUEST_TIMEOUT, headers=HEADERS,
+        cookies=cookies, follow_redirects=True,
+    ) as client:
+
+        async def fetch(page: int) -> str:
+            page_url = f"{base}?{urlencode({**query, 'p': page})}"
+            async with sem:
+                for _ in range(MAX_429_RETRIES):
+                    await limiter.acquire()
+                    resp = await client.get(page_url)
+                    if resp.status_code == 429:
+                        limiter.throttle(_parse_retry_after(resp.headers.get("Retry-After")))
+                        continue
+                    resp.raise_for_status()
+                    limiter.relax()
+                    return resp.text
+                resp.raise_for_status()  # 429 重试耗尽
+                return resp.text
+
+        page = start_page
+        tasks: "deque[Tuple[int, asyncio.Task]]" = deque()
+        try:
+            while end_page is None or page <= end_page:
+                stop = page + chunk_pages
+                if end_page is not None:
+                    stop = min(stop, end_page + 1)
+                for p in range(page, stop):
+                    tasks.append((p, asyncio.ensure_future(fetch(p))))
+                # 按页码顺序逐页产出：不等整批完成，后续页在后台继续抓
+                while tasks:
+                    p, task = tasks.popleft()
+                    yield p, await task
+                page = stop
+        finally:
+            # 消费方提前 break / aclose：取消还在飞的预取任务并收尸
+            if tasks:
+                for _, task in tasks:
+                    task.cancel()
+                await asyncio.gather(*(task for _, task in tasks), return_exceptions=True)
+
+
+# =============== RankWeek / Caption ===============
+def parse_page(html: Union[str, BeautifulSoup]) -> BeautifulSoup:
+    """整页 HTML 只解析一次；已是 soup 时直接透传，供各提取函数共用"""
+    if isinstance(html, BeautifulSoup):
+        return html
+    return BeautifulSoup(html, "lxml")
 
+
+def parse_rank_week(html: Union[str, BeautifulSoup]) -> Optional[str]:
+    """
+    RL-Woche: <span class="rankingdate">(WW-YYYY)</span> 或 <select class="publication"><option selected>WW-YYYY</option>
+    返回 YYYY-WW
+    三个候选选择器并成一条预编译 XPath，一次扫描 + 一次正则。
+    """
+    if isinstance(html, BeautifulSoup):
+        html = str(html)
+    tree = etree.HTML(html)
+    if tree is None:
+        return None
+    texts = _XPATH_RANK_WEEK(tree)
+    if not texts:
+        return None
+    raw = normalize_ws(str(texts[0])).strip("()")
+    m = _WW_YYYY_RE.match(raw)
+    if m:
+        ww, yyyy = m.group(1).zfill(2), m.group(2)
+        return f"{yyyy}-{ww}"
     return None
 
 
-def extract_caption(html_or_table: str) -> Optional[str]:
-    soup = BeautifulSoup(html_or_table, "html.parser")
+def extract_caption(html_or_table: Union[str, BeautifulSoup]) -> Optional[str]:
+    soup = parse_page(html_or_table)
     table = soup.find("table", class_="ruler")
     if not table:
         table = soup.find("table", attrs={"class": re.compile(r"\bruler\b")})
@@ -199,10 +376,10 @@ def extract_caption(html_or_table: str) -> Optional[str]:
     return normalize_ws(cap.get_text(" ", strip=True)) if cap else None
 
 
-# =============== 表格解析 ===============
-def _expand_header_cells(th: Tag) -> List[str]:
+# =============== 表格解析（lxml.etree 热路径） ===============
+def _expand_header_cells(th: etree._Element) -> List[str]:
     """展开带 colspan 的表头单元格；空白表头命名为 'Flag'。"""
-    text = normalize_ws(th.get_text(" ", strip=True))
+    text = normalize_ws(th.xpath("string(.)"))
     if text == "":
         text = "Flag"
     colspan = int(th.get("colspan", 1))
@@ -214,69 +391,45 @@ def _expand_header_cells(th: Tag) -> List[str]:
     return out
 
 
-def _extract_cell_text(td: Tag) -> str:
+def _extract_cell_text(td: etree._Element) -> str:
     """
     - 若 class 含 rank_equal / rank_up / rank_down：优先从 title 里取 'Previous rank: X' 的 X；
     - 否则优先取 <a> 文本，最后退回纯文本。
     """
     if td is None:
         return ""
-    classes = td.get("class") or []
+    classes = (td.get("class") or "").split()
     if any(c in classes for c in ("rank_equal", "rank_up", "rank_down")):
-        m = re.search(r"Previous rank:\s*(\d+)", td.get("title") or "")
+        m = _PREV_RANK_RE.search(td.get("title") or "")
         if m:
             return m.group(1)
-    a = td.find("a")
-    return normalize_ws(a.get_text(" ", strip=True) if a else td.get_text(" ", strip=True))
+    a = td.find(".//a")
+    node = a if a is not None else td
+    return normalize_ws(node.xpath("string(.)"))
 
 
-def _extract_player_id_from_td(td: Tag) -> Optional[int]:
+def _extract_player_id_from_td(td: etree._Element) -> Optional[int]:
     """从 Spieler 列 <a href="player.aspx?...&player=3423713"> 解析 PlayerId"""
     if td is None:
         return None
-    a = td.find("a")
-    if not a or not a.get("href"):
-        return None
-    href = a["href"]
-    # href 可能是相对路径，直接解析查询参数
-    try:
-        q = dict(parse_qsl(urlparse(href).query))
-        val = q.get("player")
-        if val and re.fullmatch(r"\d+", val):
-            return int(val)
-    except Exception:
+    a = td.find(".//a")
+    if a is None:
         return None
-    return None
+    m = _PLAYER_HREF_RE.search(a.get("href") or "")
+    return int(m.group(1)) if m else None
 
 
-def parse_ruler_table(
-    html_or_table: str,
-    keep_flag: bool = False,
-    rank_week: Optional[str] = None,
-    keep_raw: bool = False,  # 默认不保留 *_raw
-) -> Tuple[List[Dict], List[str]]:
-    """
-    解析 <table class="ruler">：
-    - 映射列：Rang -> Rank；Rang#2 -> RankChange（初始装“上一名次X”，稍后转为 X-Rank）
-    - 跳过分页行：<td class='noruler'>
-    - 默认丢弃 Flag 列，可 keep_flag=True 保留
-    - 增补列：PreviousRank（上一期名次）、PlayerId（来自 Spieler 链接）、RankWeek（最后）
-    - 数值字段转 int；可选保留 *_raw
-    返回 (rows, header_keys)
-    """
-    soup = BeautifulSoup(html_or_table, "html.parser")
-    table = soup.find("table", class_="ruler")
-    if not table:
-        table = soup.find("table", attrs={"class": re.compile(r"\bruler\b")})
-    if not table:
-        raise ValueError("未找到 <table class='ruler'>")
+class _HeaderState(NamedTuple):
+    """一页表头算出的行循环不变量；DOM 解析与 iterparse 流式解析共用"""
+    header_keys: List[str]
+    headers_for_zip: List[str]
+    n_cols: int
+    numeric_fields: Tuple[str, ...]
+    drop_flag: bool
+    flag_index: Optional[int]
 
-    tbody = table.find("tbody") or table
-    header_tr = tbody.find("tr")
-    raw_headers: List[str] = []
-    for th in header_tr.find_all("th"):
-        raw_headers.extend(_expand_header_cells(th))
 
+def _build_header_state(raw_headers: List[str], keep_flag: bool) -> _HeaderState:
     # 规范化列名
     canon = {
         "rang": "Rank",
@@ -301,99 +454,268 @@ def parse_ruler_table(
     if drop_flag:
         header_keys = [h for h in header_keys if h != "Flag"]
 
-    # 在 RankChange 之后插入 PreviousRank（虚拟列，不参与 zip）
-    if "PreviousRank" not in header_keys:
-        if "RankChange" in header_keys:
-            idx = header_keys.index("RankChange") + 1
-            header_keys.insert(idx, "PreviousRank")
-        else:
-            header_keys.insert(1, "PreviousRank")
+    # zip 对齐表头：保持 td 原始列序（虚拟列不对应任何 td）
+    headers_for_zip = [h for h in header_keys if h not in _VIRTUAL_COLS]
 
-    # 在 Player 之后插入 PlayerId（虚拟列，不参与 zip）
-    if "PlayerId" not in header_keys:
-        if "Player" in header_keys:
-            idx = header_keys.index("Player") + 1
-            header_keys.insert(idx, "PlayerId")
-        else:
-            header_keys.append("PlayerId")
+    # 最终表头按规范模板一次排出：已有列 + 强制插入的虚拟列；
+    # 未知列插在 RankWeek 之前，保持“RankWeek 永远最后”的不变量
+    present = set(header_keys)
+    header_keys = (
+        [h for h in _CANON_ORDER[:-1] if h in present or h in _VIRTUAL_COLS]
+        + [h for h in header_keys if h not in _CANON_ORDER]
+        + ["RankWeek"]
+    )
+    return _HeaderState(
+        header_keys=header_keys,
+        headers_for_zip=headers_for_zip,
+        n_cols=len(headers_for_zip),
+        numeric_fields=tuple(f for f in _NUMERIC_FIELDS if f in headers_for_zip),
+        drop_flag=drop_flag,
+        flag_index=flag_index,
+    )
 
-    rows: List[Dict] = []
-    for tr in tbody.find_all("tr"):
-        if tr.find("th"):
-            continue
-        if tr.find("td", class_="noruler"):
-            continue
 
-        tds = tr.find_all("td")
-        if not tds:
-            continue
+def _row_from_tds(tds: List[etree._Element], state: _HeaderState, rank_week: Optional[str]) -> Optional[Dict]:
+    """一行 <td> 列表 → rec（数值清洗前）；无 td 时返回 None"""
+    if not tds:
+        return None
 
-        values = [_extract_cell_text(td) for td in tds]
+    values = [_extract_cell_text(td) for td in tds]
 
-        # 删除“空白 UI 列”对应的值（用原始 flag_index，避免错删 Player）
-        if drop_flag and flag_index is not None and flag_index < len(values):
-            del values[flag_index]
+    # 删除“空白 UI 列”对应的值（用原始 flag_index，避免错删 Player）
+    if state.drop_flag and state.flag_index is not None and state.flag_index < len(values):
+        del values[state.flag_index]
 
-        # 构造 zip 对齐的表头（排除虚拟列）
-        headers_for_zip = [h for h in header_keys if h not in ("PreviousRank", "PlayerId", "RankWeek")]
+    if len(values) < state.n_cols:
+        values += [""] * (state.n_cols - len(values))
+    elif len(values) > state.n_cols:
+        values = values[: state.n_cols]
 
-        if len(values) < len(headers_for_zip):
-            values += [""] * (len(headers_for_zip) - len(values))
-        if len(values) > len(headers_for_zip):
-            values = values[: len(headers_for_zip)]
+    rec = dict(zip(state.headers_for_zip, values))
 
-        rec = dict(zip(headers_for_zip, values))
+    # 抓 PlayerId
+    try:
+        pid = _extract_player_id_from_td(tds[3])  # 注意：原始第4列是 Spieler
+    except Exception:
+        pid = None
+    rec["PlayerId"] = pid if pid is not None else ""
+
+    # RankWeek
+    rec["RankWeek"] = rank_week or ""
+    return rec
+
+
+def _finalize_rows(rows: List[Dict], state: _HeaderState, keep_raw: bool) -> Tuple[List[Dict], List[str]]:
+    """数值清洗 & PreviousRank/RankChange（大批量且有 pandas 时向量化）"""
+    if pd is not None and len(rows) >= _BATCH_COERCE_MIN_ROWS:
+        coerce_numeric_batch(rows, numeric_fields=state.numeric_fields, keep_raw=keep_raw)
+    else:
+        for rec in rows:
+            _coerce_numeric_row(rec, state.numeric_fields, keep_raw)
+
+    # RankWeek 已由 _CANON_ORDER 模板排进表头（永远最后）
+    return rows, state.header_keys
+
+
+def _coerce_numeric_row(rec: Dict, numeric_fields: Tuple[str, ...], keep_raw: bool) -> None:
+    """逐行数值清洗 + PreviousRank/RankChange 计算（小批量 / 无 pandas 时的路径）"""
+    # 转数值；此时 RankChange 仍是“上一名次X”
+    for f in numeric_fields:
+        if keep_raw:
+            rec[f + "_raw"] = rec[f]
+        num = str(rec[f]).translate(_NUM_TRANS)
+        if not num.isascii():
+            num = _NUM_RE.sub("", num)
+        if num:
+            try:
+                rec[f] = int(num)
+            except ValueError:
+                pass
 
-        # 抓 PlayerId
-        try:
-            pid = _extract_player_id_from_td(tds[3])  # 注意：原始第4列是 Spieler
-        except Exception:
-            pid = None
-        rec["PlayerId"] = pid if pid is not None else ""
-
-        # 转数值；此时 RankChange 仍是“上一名次X”
-        for f in ("Rank", "BirthYear", "Points", "Tournaments", "RankChange"):
-            if f in rec:
-                if keep_raw:
-                    rec[f + "_raw"] = rec[f]
-                num = re.sub(r"[^\d\-]", "", str(rec[f]))
-                if num:
-                    try:
-                        rec[f] = int(num)
-                    except ValueError:
-                        pass
-
-        # 计算 PreviousRank 与 RankChange
+    # 计算 PreviousRank 与 RankChange
+    prev_rank_int = None
+    try:
+        raw_prev = rec.get("RankChange_raw") if keep_raw else rec.get("RankChange")
+        if isinstance(rec.get("RankChange"), int) and not keep_raw:
+            prev_rank_int = rec["RankChange"]  # 不保留 raw 时，这里暂存的是“上一名次X”
+        else:
+            m = _DIGITS_RE.search(str(raw_prev)) if raw_prev is not None else None
+            if m:
+                prev_rank_int = int(m.group())
+    except Exception:
         prev_rank_int = None
-        try:
-            raw_prev = rec.get("RankChange_raw") if keep_raw else rec.get("RankChange")
-            if isinstance(rec.get("RankChange"), int) and not keep_raw:
-                prev_rank_int = rec["RankChange"]  # 不保留 raw 时，这里暂存的是“上一名次X”
+
+    curr_rank_int = rec.get("Rank") if isinstance(rec.get("Rank"), int) else None
+    if prev_rank_int is not None and curr_rank_int is not None:
+        rec["PreviousRank"] = prev_rank_int
+        rec["RankChange"] = prev_rank_int - curr_rank_int
+    else:
+        rec["PreviousRank"] = ""
+        rec["RankChange"] = 0
+
+
+def coerce_numeric_batch(
+    rows: List[Dict],
+    numeric_fields: Tuple[str, ...] = _NUMERIC_FIELDS,
+    keep_raw: bool = False,
+) -> List[Dict]:
+    """
+    pandas 向量化版数值清洗：整批 rows 一次 DataFrame 化，str.replace/to_numeric
+    在 C 层跑；PreviousRank/RankChange 也整列相减。结果写回原 dict。
+    """
+    if not rows or pd is None:
+        return rows
+    df = pd.DataFrame(rows)
+    fields = [f for f in numeric_fields if f in df.columns]
+
+    coerced = {}
+    for f in fields:
+        if keep_raw:
+            for rec, v in zip(rows, df[f].tolist()):
+                rec[f + "_raw"] = v
+        cleaned = df[f].astype(str).str.replace(r"[^\d\-]", "", regex=True)
+        coerced[f] = pd.to_numeric(cleaned, errors="coerce")
+
+    # 可转的写回 int；转不了的（空串等）保留原值
+    for f in fields:
+        if f == "RankChange":
+            continue  # 下面与 Rank 一起算
+        for rec, v in zip(rows, coerced[f].tolist()):
+            if v == v:  # not NaN
+                rec[f] = int(v)
+
+    # RankChange 列此时暂存“上一名次X”；整列相减得涨跌
+    prev = coerced.get("RankChange")
+    rank = coerced.get("Rank")
+    if prev is not None and rank is not None:
+        change = prev - rank
+        for rec, pv, cv in zip(rows, prev.tolist(), change.tolist()):
+            if pv == pv and cv == cv:
+                rec["PreviousRank"] = int(pv)
+                rec["RankChange"] = int(cv)
             else:
-                m = re.search(r"\d+", str(raw_prev)) if raw_prev is not None else None
-                if m:
-                    prev_rank_int = int(m.group())
-        except Exception:
-            prev_rank_int = None
-
-        curr_rank_int = rec.get("Rank") if isinstance(rec.get("Rank"), int) else None
-        if prev_rank_int is not None and curr_rank_int is not None:
-            rec["PreviousRank"] = prev_rank_int
-            rec["RankChange"] = prev_rank_int - curr_rank_int
-        else:
+                rec["PreviousRank"] = ""
+                rec["RankChange"] = 0
+    else:
+        for rec in rows:
             rec["PreviousRank"] = ""
             rec["RankChange"] = 0
+    return rows
+
+
+def parse_ruler_table(
+    html_or_table: Union[str, BeautifulSoup],
+    keep_flag: bool = False,
+    rank_week: Optional[str] = None,
+    keep_raw: bool = False,  # 默认不保留 *_raw
+) -> Tuple[List[Dict], List[str]]:
+    """
+    解析 <table class="ruler">：
+    - 映射列：Rang -> Rank；Rang#2 -> RankChange（初始装“上一名次X”，稍后转为 X-Rank）
+    - 跳过分页行：<td class='noruler'>
+    - 默认丢弃 Flag 列，可 keep_flag=True 保留
+    - 增补列：PreviousRank（上一期名次）、PlayerId（来自 Spieler 链接）、RankWeek（最后）
+    - 数值字段转 int；可选保留 *_raw
+    返回 (rows, header_keys)
+    热路径走 lxml.etree + 预编译 XPath；传入 soup 时先序列化（仅兼容旧调用方）。
+    """
+    if isinstance(html_or_table, BeautifulSoup):
+        html_or_table = str(html_or_table)
+    tree = etree.HTML(html_or_table)
+    tables = _XPATH_TABLE(tree) if tree is not None else []
+    if not tables:
+        raise ValueError("未找到 <table class='ruler'>")
+    table = tables[0]
 
-        # RankWeek
-        rec["RankWeek"] = rank_week or ""
+    tbody = table.find("tbody")
+    if tbody is None:
+        tbody = table
+    raw_headers: List[str] = []
+    for th in _XPATH_HEADER_THS(tbody):
+        raw_headers.extend(_expand_header_cells(th))
 
-        rows.append(rec)
+    state = _build_header_state(raw_headers, keep_flag)
 
-    # 确保 RankWeek 在表头
-    if "RankWeek" not in header_keys:
-        header_keys.append("RankWeek")
+    rows: List[Dict] = []
+    for tr in _XPATH_ROWS(tbody):
+        rec = _row_from_tds(tr.findall("td"), state, rank_week)
+        if rec is not None:
+            rows.append(rec)
 
-    return rows, header_keys
+    return _finalize_rows(rows, state, keep_raw)
+
+
+def parse_ruler_table_streaming(
+    html_or_table: Union[str, bytes, BeautifulSoup],
+    keep_flag: bool = False,
+    rank_week: Optional[str] = None,
+    keep_raw: bool = False,
+) -> Tuple[List[Dict], List[str]]:
+    """
+    parse_ruler_table 的流式变体：etree.iterparse 按事件增量解析，每个 <tr>
+    处理完立即 clear() 释放，整页 DOM 从不驻留内存 —— 超大 --page-size
+    （数百行以上）时峰值内存与页大小无关。行语义与 parse_ruler_table 一致。
+    """
+    if isinstance(html_or_table, BeautifulSoup):
+        html_or_table = str(html_or_table)
+    data = html_or_table.encode("utf-8") if isinstance(html_or_table, str) else html_or_table
+
+    state: Optional[_HeaderState] = None
+    rows: List[Dict] = []
+    table_depth = 0  # 0=未进入 ruler 表；进入后按嵌套深度配平
+
+    # encoding 必须显式给出：bytes 是上面按 UTF-8 编出来的，不给的话 libxml2
+    # 会按 <meta charset> 嗅探（没有就当 Latin-1），变音符名字全部乱码
+    for event, elem in etree.iterparse(
+        io.BytesIO(data), html=True, encoding="utf-8", events=("start", "end")
+    ):
+        tag = elem.tag
+        if event == "start":
+            if tag == "table":
+                if table_depth > 0:
+                    table_depth += 1
+                elif "ruler" in (elem.get("class") or "").split():
+                    table_depth = 1
+            continue
+
+        if table_depth == 0:
+            if tag == "html":
+                break  # 整页扫完也没有 ruler 表
+            continue
+        if tag == "table":
+            table_depth -= 1
+            if table_depth == 0:
+                break  # ruler 表结束，后面的文档不用再读
+            continue
+        if tag != "tr":
+            continue
+
+        tr = elem
+        if state is None:
+            # 第一行视为表头
+            ths = tr.findall(".//th")
+            if ths:
+                raw_headers: List[str] = []
+                for th in ths:
+                    raw_headers.extend(_expand_header_cells(th))
+                state = _build_header_state(raw_headers, keep_flag)
+        elif tr.find(".//th") is None and not any(
+            "noruler" in (td.get("class") or "").split() for td in tr.iterchildren("td")
+        ):
+            rec = _row_from_tds(tr.findall("td"), state, rank_week)
+            if rec is not None:
+                rows.append(rec)
+
+        # 立刻回收已处理的行及其之前的兄弟节点
+        tr.clear(keep_tail=False)
+        parent = tr.getparent()
+        if parent is not None:
+            while tr.getprevious() is not None:
+                del parent[0]
+
+    if state is None:
+        raise ValueError("未找到 <table class='ruler'>")
+    return _finalize_rows(rows, state, keep_raw)
 
 
 # =============== 首页解析辅助（供 main 使用） ===============
@@ -3,30 +3,69 @@ import os
 import csv
 from typing import List, Dict
 
+# 写缓冲攒到 1 MiB 再落盘，保证大块写
+_FLUSH_BYTES = 1 << 20
+
+
+def _fmt(v) -> bytes:
+    """单元格 → CSV 字节：int/空值直通；含 , " \\r \\n 的字符串按 RFC4180 加引号"""
+    if isinstance(v, int):
+        return b"%d" % v
+    if v is None or v == "":
+        return b""
+    s = str(v)
+    if '"' in s or "," in s or "\r" in s or "\n" in s:
+        s = '"' + s.replace('"', '""') + '"'
+    return s.encode("utf-8")
+
+
 class CSVWriterSink:
     """
     with CSVWriterSink(out_csv, fieldnames) as sink:
         sink.write_many(rows)
+    默认走字节快路径：行直接渲染成 bytes、攒 1 MiB 再写，省掉 csv 模块的
+    逐单元格 Python 开销；safe=True（--safe-csv）退回 csv.writer。
     """
-    def __init__(self, out_csv: str, fieldnames: List[str]):
+    def __init__(self, out_csv: str, fieldnames: List[str], safe: bool = False):
         self.out_csv = out_csv
         self.fieldnames = fieldnames
+        self.safe = safe
         self._f = None
         self._w = None
+        self._buf = None
 
     def __enter__(self):
         os.makedirs(os.path.dirname(self.out_csv) or ".", exist_ok=True)
-        self._f = open(self.out_csv, "w", newline="", encoding="utf-8")
-        self._w = csv.DictWriter(self._f, fieldnames=self.fieldnames)
-        self._w.writeheader()
+        if self.safe:
+            # 1 MiB 缓冲：按大块 fwrite，减少系统调用
+            self._f = open(self.out_csv, "w", newline="", encoding="utf-8", buffering=1 << 20)
+            # csv.writer + 元组：避免 DictWriter 每行每列的字段名解析
+            self._w = csv.writer(self._f)
+            self._w.writerow(self.fieldnames)
+        else:
+            self._f = open(self.out_csv, "wb", buffering=1 << 20)
+            self._buf = bytearray()
+            self._buf += b",".join(_fmt(k) for k in self.fieldnames) + b"\r\n"
         return self
 
     def __exit__(self, exc_type, exc, tb):
         if self._f:
+            if self._buf:
+                self._f.write(bytes(self._buf))
+                self._buf = None
             self._f.close()
             self._f = None
             self._w = None
 
     def write_many(self, rows: List[Dict]):
+        fields = self.fieldnames
+        if self.safe:
+            self._w.writerows(tuple(r.get(k, "") for k in fields) for r in rows)
+            return
+        buf = self._buf
         for r in rows:
-            self._w.writerow(r)
\ No newline at end of file
+            buf += b",".join(_fmt(r.get(k, "")) for k in fields)
+            buf += b"\r\n"
+        if len(buf) >= _FLUSH_BYTES:
+            self._f.write(bytes(buf))
+            buf.clear()
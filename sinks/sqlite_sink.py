@@ -3,6 +3,13 @@ import os
 import sqlite3
 from typing import Iterable, Dict, Sequence, Optional
 
+try:
+    import msgpack
+    import zstandard
+except ImportError:  # msgpack/zstandard 可选：仅 --pack（write_page_blob）需要
+    msgpack = None
+    zstandard = None
+
 DDL = """
 CREATE TABLE IF NOT EXISTS rankings (
   Rank         INTEGER,
@@ -21,13 +28,20 @@ CREATE TABLE IF NOT EXISTS rankings (
 );
 CREATE INDEX IF NOT EXISTS idx_rankings_week_caption_rank
   ON rankings (RankWeek, Caption, Rank);
+CREATE TABLE IF NOT EXISTS rankings_pages (
+  RankWeek TEXT,
+  Caption  TEXT,
+  Page     INTEGER,
+  Blob     BLOB,
+  PRIMARY KEY (RankWeek, Caption, Page)
+);
 """
 
 UPSERT = """
 INSERT INTO rankings
   (Rank, RankChange, PreviousRank, Player, PlayerId, BirthYear, Points, Region, Club, Tournaments, RankWeek, Caption)
 VALUES
-  (:Rank, :RankChange, :PreviousRank, :Player, :PlayerId, :BirthYear, :Points, :Region, :Club, :Tournaments, :RankWeek, :Caption)
+  (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
 ON CONFLICT(RankWeek, Caption, PlayerId) DO UPDATE SET
   Rank         = excluded.Rank,
   RankChange   = excluded.RankChange,
@@ -40,10 +54,17 @@ ON CONFLICT(RankWeek, Caption, PlayerId) DO UPDATE SET
   Tournaments  = excluded.Tournaments;
 """
 
-ALLOWED_KEYS = {
+PAGE_UPSERT = """
+INSERT INTO rankings_pages (RankWeek, Caption, Page, Blob)
+VALUES (?, ?, ?, ?)
+ON CONFLICT(RankWeek, Caption, Page) DO UPDATE SET Blob = excluded.Blob;
+"""
+
+# 与 UPSERT 的 ? 占位符一一对应的固定列序（RankWeek/Caption 由调用方参数填充）
+ALLOWED_KEYS_ORDERED = (
     "Rank", "RankChange", "PreviousRank", "Player", "PlayerId",
-    "BirthYear", "Points", "Region", "Club", "Tournaments", "RankWeek", "Caption"
-}
+    "BirthYear", "Points", "Region", "Club", "Tournaments",
+)
 
 class SQLiteSink:
     """
@@ -51,18 +72,27 @@ class SQLiteSink:
       with SQLiteSink("db/rankings.sqlite") as sink:
           sink.ensure_schema()
           sink.write_many(rows, caption, rank_week)
+    写入按页计数、每 flush_every 页 commit 一次（退出时兜底 commit），
+    避免流式模式下每页一次 fsync。
     """
 
-    def __init__(self, db_path: str):
+    def __init__(self, db_path: str, flush_every: int = 10):
         self.db_path = db_path
+        self.flush_every = max(1, flush_every)
         os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
         self.conn: Optional[sqlite3.Connection] = None
+        self._batches_since_commit = 0
+        self._zstd = zstandard.ZstdCompressor(level=3) if zstandard is not None else None
 
     def __enter__(self):
-        self.conn = sqlite3.connect(self.db_path)
+        # 允许跨线程使用：写入统一由 main 的专职写线程串行执行，
+        # 建连/建表/收尾仍在主线程（写线程 join 之后）
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
         self.conn.execute("PRAGMA journal_mode=WAL;")
         self.conn.execute("PRAGMA synchronous=NORMAL;")
         self.conn.execute("PRAGMA foreign_keys=ON;")
+        self.conn.execute("PRAGMA cache_size=-20000;")
+        self.conn.execute("PRAGMA temp_store=MEMORY;")
         return self
 
     def __exit__(self, exc_type, exc, tb):
@@ -82,17 +112,36 @@ class SQLiteSink:
                 cur.execute(stmt)
         self.conn.commit()
 
-    def _adapt_row(self, row: Dict, caption: str, rank_week: str) -> Dict:
-        # 过滤掉 *_raw 等非数据库列，并补齐 Caption/RankWeek
-        out = {k: row.get(k) for k in ALLOWED_KEYS if k in row}
-        out["Caption"] = caption
-        out["RankWeek"] = rank_week
-        return out
-
     def write_many(self, rows: Sequence[Dict], caption: str, rank_week: str):
         if not rows:
             return
         assert self.conn is not None
-        adapted = [self._adapt_row(r, caption, rank_week) for r in rows]
+        # 固定列序的元组 + ? 绑定：省去每行的 dict 构造和名字→索引查找；
+        # *_raw 等非数据库列天然被过滤，Caption/RankWeek 统一用参数补齐
+        adapted = (
+            tuple(r.get(k) for k in ALLOWED_KEYS_ORDERED) + (rank_week, caption)
+            for r in rows
+        )
         self.conn.executemany(UPSERT, adapted)
-        self.conn.commit()
+        self._maybe_commit()
+
+    def write_page_blob(self, rows: Sequence[Dict], caption: str, rank_week: str, page: int):
+        """
+        envelope 打包：整页 rows 经 msgpack 序列化 + zstd(level=3) 压缩后写成
+        rankings_pages 的一行，省掉每行的 B-tree 插入开销；点查仍走 rankings 表。
+        """
+        if not rows:
+            return
+        if msgpack is None or self._zstd is None:
+            raise RuntimeError("--pack 需要可选依赖 msgpack 与 zstandard（pip install msgpack zstandard）")
+        assert self.conn is not None
+        blob = self._zstd.compress(msgpack.packb(list(rows), use_bin_type=True))
+        self.conn.execute(PAGE_UPSERT, (rank_week, caption, page, blob))
+        self._maybe_commit()
+
+    def _maybe_commit(self):
+        # 事务跨多页摊薄 commit/fsync 成本；__exit__ 兜底提交尾批
+        self._batches_since_commit += 1
+        if self._batches_since_commit >= self.flush_every:
+            self.conn.commit()
+            self._batches_since_commit = 0